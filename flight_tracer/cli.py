@@ -1,9 +1,35 @@
 import click
 import os
+import json
+import numpy as np
 import pandas as pd
-import geopandas as gpd
+import pyogrio
 from datetime import date
 from flight_tracer import FlightTracer
+from flight_tracer.core import json_loads
+
+def write_raw(raw_df, filename):
+    """Write raw traces as Feather, storing the mixed-type columns as text Arrow can hold."""
+    raw_df = raw_df.assign(
+        altitude=raw_df["altitude"].astype("string"),
+        details=raw_df["details"].map(lambda d: json.dumps(d) if isinstance(d, dict) else None),
+    )
+    raw_df.reset_index(drop=True).to_feather(filename)
+
+def read_raw(path):
+    """Read raw traces from Feather (or a legacy CSV) back into the shape get_traces returns."""
+    if not path.endswith(".feather"):
+        return pd.read_csv(path)
+    raw_df = pd.read_feather(path)
+    raw_df["details"] = raw_df["details"].map(lambda d: json_loads(d) if isinstance(d, str) else None)
+    # Altitude was stored as text; numbers come back as numbers and "ground" stays a string
+    altitude = raw_df["altitude"].to_numpy(dtype=object, na_value=None)
+    numeric = pd.to_numeric(raw_df["altitude"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    is_number = ~np.isnan(numeric)
+    feet = numeric[is_number]
+    altitude[is_number] = (feet.astype(np.int64) if np.all(feet % 1 == 0) else feet).tolist()
+    raw_df["altitude"] = altitude
+    return raw_df
 
 @click.group()
 def cli():
@@ -15,7 +41,8 @@ def cli():
 @click.option('--start', required=True, type=click.DateTime(formats=["%Y-%m-%d"]), help='Start date (YYYY-MM-DD)')
 @click.option('--end', required=True, type=click.DateTime(formats=["%Y-%m-%d"]), help='End date (YYYY-MM-DD)')
 @click.option('--output', default='data/', help='Directory to save raw data')
-def fetch(icao, start, end, output):
+@click.option('--csv', 'as_csv', is_flag=True, help='Save raw data as CSV instead of Feather')
+def fetch(icao, start, end, output, as_csv):
     """Fetch raw flight trace data from ADS-B Exchange."""
     tracer = FlightTracer(aircraft_ids=[icao])
     raw_df = tracer.get_traces(start.date(), end.date())
@@ -25,33 +52,37 @@ def fetch(icao, start, end, output):
         return
     
     os.makedirs(output, exist_ok=True)
-    filename = os.path.join(output, f"raw_{icao}_{start.date()}_{end.date()}.csv")
-    raw_df.to_csv(filename, index=False)
+    extension = "csv" if as_csv else "feather"
+    filename = os.path.join(output, f"raw_{icao}_{start.date()}_{end.date()}.{extension}")
+    if as_csv:
+        raw_df.to_csv(filename, index=False)
+    else:
+        write_raw(raw_df, filename)
     click.echo(f"Saved raw data to {filename}")
 
 @click.command()
-@click.option('--input', required=True, type=click.Path(exists=True), help='Path to raw flight data CSV')
+@click.option('--input', required=True, type=click.Path(exists=True), help='Path to raw flight data (Feather or CSV)')
 @click.option('--filter-ground', is_flag=True, help='Exclude ground data from processing')
 @click.option('--timezone', default=None, help='Optional timezone for point_time conversion')
 def process(input, filter_ground, timezone):
     """Process raw flight data into structured GeoDataFrame."""
-    raw_df = pd.read_csv(input)
+    raw_df = read_raw(input)
     if raw_df.empty or "icao" not in raw_df.columns:
-        click.echo("Error: Invalid flight data. Ensure the CSV contains valid flight traces.")
+        click.echo(f"Error: Invalid flight data. Ensure {input} contains valid flight traces.")
         return
     
     gdf = FlightTracer.process_flight_data(None, raw_df, filter_ground=filter_ground, timezone=timezone)
 
-    processed_filename = input.replace("raw_", "processed_").replace(".csv", ".geojson")
-    gdf.to_file(processed_filename, driver="GeoJSON")
+    processed_filename = input.replace("raw_", "processed_").rsplit('.', 1)[0] + ".geojson"
+    pyogrio.write_dataframe(gdf, processed_filename, driver="GeoJSON")
     click.echo(f"Processed data saved as {processed_filename}")
 
 @click.command()
 @click.option('--input', required=True, type=click.Path(exists=True), help='Path to processed flight data')
-@click.option('--format', type=click.Choice(['csv', 'geojson', 'shp']), default='geojson', help='Output format')
+@click.option('--format', type=click.Choice(['csv', 'geojson', 'shp', 'parquet']), default='geojson', help='Output format')
 def export(input, format):
     """Export processed data in different formats."""
-    gdf = gpd.read_file(input)
+    gdf = pyogrio.read_dataframe(input)
     base_path = input.replace("processed_", "exported_").rsplit('.', 1)[0]
     
     if format == 'csv':
@@ -59,10 +90,13 @@ def export(input, format):
         gdf.drop(columns='geometry', errors='ignore').to_csv(output_file, index=False)
     elif format == 'geojson':
         output_file = f"{base_path}.geojson"
-        gdf.to_file(output_file, driver="GeoJSON")
+        pyogrio.write_dataframe(gdf, output_file, driver="GeoJSON")
     elif format == 'shp':
         output_file = f"{base_path}.shp"
-        gdf.to_file(output_file, driver="ESRI Shapefile")
+        pyogrio.write_dataframe(gdf, output_file, driver="ESRI Shapefile")
+    elif format == 'parquet':
+        output_file = f"{base_path}.parquet"
+        gdf.to_parquet(output_file, write_covering_bbox=True, compression='zstd')
     
     click.echo(f"Exported data as {output_file}")
 
@@ -70,9 +104,10 @@ def export(input, format):
 @click.option('--input', required=True, type=click.Path(exists=True), help='Path to processed flight data')
 @click.option('--bucket', required=True, help='AWS S3 bucket name')
 @click.option('--aws-profile', default=None, help='AWS profile name for authentication')
-def upload(input, bucket, aws_profile):
+@click.option('--compress', is_flag=True, help='zstd-compress the CSV and GeoJSON uploads (adds .zst to their keys)')
+def upload(input, bucket, aws_profile, compress):
     """Upload processed data to AWS S3 with an optional AWS profile."""
-    gdf = gpd.read_file(input)  # Load processed GeoDataFrame
+    gdf = pyogrio.read_dataframe(input)  # Load processed GeoDataFrame
     file_name = os.path.basename(input)
 
     from flight_tracer.core import FlightTracer  # Import inside function
@@ -84,7 +119,13 @@ def upload(input, bucket, aws_profile):
         click.echo("Error: AWS S3 client not initialized. Check your credentials or profile.")
         return
 
-    tracer.upload_to_s3(gdf, bucket, f"flight_tracer/{file_name}", f"flight_tracer/{file_name}.geojson")
+    parquet_name = f"{file_name.rsplit('.', 1)[0]}.parquet"
+    try:
+        tracer.upload_to_s3(gdf, bucket, f"flight_tracer/{file_name}", f"flight_tracer/{file_name}.geojson",
+                            parquet_object_name=f"flight_tracer/{parquet_name}", compress=compress)
+    except ImportError as e:
+        click.echo(f"Error: {e}")
+        return
 
     click.echo(f"Uploaded {file_name} to S3 bucket {bucket} (AWS profile: {aws_profile if aws_profile else 'default'})")
 
@@ -93,7 +134,7 @@ def upload(input, bucket, aws_profile):
 @click.option('--output', required=True, type=click.Path(), help='Output image file for the plot')
 def plot(input, output):
     """Plot flight paths with a basemap."""
-    gdf = gpd.read_file(input)  # Load processed data
+    gdf = pyogrio.read_dataframe(input)  # Load processed data
 
     from flight_tracer.core import FlightTracer  # Import inside function
     FlightTracer.plot_flights(None, gdf, geometry_type='points', fig_filename=output)
@@ -1,13 +1,27 @@
 # flight_tracer/core.py
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+import pyogrio
 import os
+import re
+import gzip
+import zlib
+import time
+import hashlib
+import functools
+import tempfile
 import pytz
-from datetime import date, timedelta
+from datetime import date, datetime
 from io import BytesIO
-from shapely.geometry import LineString
+import shapely
 import matplotlib.pyplot as plt
 import contextily as ctx
 import matplotlib.cm as cm
@@ -16,6 +30,93 @@ import matplotlib.colors as mcolors
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning, message="Column names longer than 10 characters")
 
+# orjson parses trace bytes much faster; the stdlib parser also accepts bytes as a fallback
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# numba is optional; without it leg numbering uses the vectorized NumPy path
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# datashader is optional; without it plot_flights always draws points as matplotlib markers
+try:
+    import datashader as ds
+    import datashader.transfer_functions as tf
+except ImportError:
+    ds = None
+
+# zstandard is optional; it's only needed for upload_to_s3(compress=True)
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+
+def _sorted_leg_ids(keys, times, threshold_ns):
+    """Single-pass leg numbering over rows already grouped by key and in time order."""
+    n = len(keys)
+    leg_ids = np.empty(n, dtype=np.int32)
+    leg = 1
+    for i in range(n):
+        if i == 0 or keys[i] != keys[i - 1]:
+            leg = 1
+        elif times[i] - times[i - 1] > threshold_ns:
+            leg += 1
+        leg_ids[i] = leg
+    return leg_ids
+
+
+if njit is not None:
+    _sorted_leg_ids = njit(cache=True)(_sorted_leg_ids)
+
+
+def _compute_leg_ids(group_keys, times_ns, threshold_ns):
+    """
+    Number flight legs within each group: a new leg starts whenever the gap to the
+    previous ping of the same group exceeds threshold_ns. Rows only need to be in
+    time order within each group; the result is aligned with the input rows.
+    """
+    n = len(group_keys)
+    leg_ids = np.ones(n, dtype=np.int32)
+    if n < 2:
+        return leg_ids
+
+    # Stable sort by group keeps each group's pings in their existing time order
+    order = np.argsort(group_keys, kind="stable")
+    keys = group_keys[order]
+    times = times_ns[order]
+
+    if njit is not None:
+        leg_ids[order] = _sorted_leg_ids(keys, times, threshold_ns)
+        return leg_ids
+
+    same_group = keys[1:] == keys[:-1]
+    new_leg = np.zeros(n, dtype=np.int32)
+    new_leg[1:] = same_group & ((times[1:] - times[:-1]) > threshold_ns)
+
+    # Running count of new legs, restarted at every group boundary
+    running = np.cumsum(new_leg)
+    group_starts = np.flatnonzero(np.r_[True, ~same_group])
+    group_index = np.cumsum(np.r_[True, ~same_group]) - 1
+    leg_ids[order] = running - running[group_starts][group_index] + 1
+    return leg_ids
+
+
+@functools.lru_cache(maxsize=8)
+def _load_meta(url):
+    """Read an aircraft metadata file once per process; callers get their own copy."""
+    return pd.read_json(url)
+
+
+def _parse_trace_bytes(raw, icao):
+    """Process-pool entry point: parse raw trace bytes into trace columns and metadata."""
+    return FlightTracer._build_trace_columns(json_loads(raw), icao)
+
+
 class FlightTracer:
     # Default columns from the ADSB trace data (we’ll drop the extra ones)
     DEFAULT_COLUMNS = [
@@ -24,16 +125,38 @@ class FlightTracer:
         "unknown2", "unknown3", "unknown4",
     ]
     DROP_COLUMNS = ["unknown1", "code", "baro_rate", "unknown2", "unknown3", "unknown4"]
-
-    def __init__(self, aircraft_ids=None, meta_url=None, aws_creds=None, aws_profile=None):
+    # Columns materialized on fetch and their dtypes (None keeps the raw objects); the dropped
+    # ones are never built. time, lat and lon stay float64 to keep sub-ms and sub-metre precision
+    KEEP_DTYPES = {
+        "time": "float64", "lat": "float64", "lon": "float64", "altitude": None,
+        "ground_speed": "float32", "heading": "float32", "details": None, "alt_geom": "float32",
+    }
+    KEEP_COLUMNS = list(KEEP_DTYPES)
+    KEEP_INDICES = list(map(DEFAULT_COLUMNS.index, KEEP_COLUMNS))
+    # Default number of concurrent trace downloads (and pooled connections to ADSBExchange)
+    MAX_WORKERS = 32
+    # On-disk cache for downloaded trace JSON; past days never change, anything else expires
+    DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "flight_tracer")
+    CACHE_TTL_SECONDS = 15 * 60
+    # Standard retry mode, plus enough pooled connections for the concurrent multipart upload parts
+    S3_CONFIG = Config(retries={"mode": "standard", "max_attempts": 3}, max_pool_connections=32, tcp_keepalive=True)
+    # (connect, read) timeouts in seconds; a dead host fails fast without cutting off large traces
+    REQUEST_TIMEOUT = (3, 10)
+    # Above this many points plot_flights rasterizes them with datashader, if it's installed
+    DATASHADER_MIN_POINTS = 100_000
+
+    def __init__(self, aircraft_ids=None, meta_url=None, aws_creds=None, aws_profile=None,
+                 cache_dir=DEFAULT_CACHE_DIR, max_workers=MAX_WORKERS):
         """
         Initialize with a list of aircraft_ids or a metadata URL.
         Optionally pass aws_creds as a dict with keys:
           'aws_access_key_id' and 'aws_secret_access_key'.
         Alternatively, pass aws_profile to use a specific AWS CLI profile.
+        Downloaded traces and basemap tiles are cached under cache_dir; pass cache_dir=None to disable.
+        max_workers sets how many traces are downloaded at once; lower it if you hit rate limits.
         """
         if meta_url:
-            meta_df = pd.read_json(meta_url)
+            meta_df = _load_meta(meta_url).copy()
             # Clean up and extract ICAO codes from metadata
             self.aircraft_ids = meta_df["icao"].str.strip().str.lower().tolist()
             self.meta_df = meta_df
@@ -42,17 +165,28 @@ class FlightTracer:
             self.meta_df = None
         else:
             raise ValueError("Either aircraft_ids or meta_url must be provided")
-        
+
+        # Shared HTTP session so concurrent fetches reuse keep-alive connections
+        self.max_workers = max_workers
+        self._session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retries)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self.cache_dir = cache_dir
+        # Set once a cache write fails, so an unwritable cache_dir is reported once and then skipped
+        self._cache_write_failed = False
 
         # Set up S3 client using aws_profile if provided, else explicit credentials if provided
         if aws_profile:
             session = boto3.Session(profile_name=aws_profile)
-            self.s3_client = session.client('s3')
+            self.s3_client = session.client('s3', config=self.S3_CONFIG)
         elif aws_creds:
             self.s3_client = boto3.client(
                 's3',
                 aws_access_key_id=aws_creds.get('aws_access_key_id'),
-                aws_secret_access_key=aws_creds.get('aws_secret_access_key')
+                aws_secret_access_key=aws_creds.get('aws_secret_access_key'),
+                config=self.S3_CONFIG
             )
         else:
             self.s3_client = None
@@ -71,53 +205,160 @@ class FlightTracer:
         base_url_recent = "https://globe.adsbexchange.com/data/traces/"
         base_url_historical = "https://globe.adsbexchange.com/globe_history/"
         
-        urls = []
-        for icao in self.aircraft_ids:
-            icao_suffix = icao[-2:]
-
-            if recent:
-                # Use the single, fixed "recent" URL
-                url = f"{base_url_recent}{icao_suffix}/trace_full_{icao}.json"
-                urls.append((url, icao))
-            else:
-                # Generate historical URLs with date structure
-                delta = timedelta(days=1)
-                current_date = start_date
-                while current_date <= end_date:
-                    year = current_date.strftime("%Y")
-                    month = current_date.strftime("%m")
-                    day = current_date.strftime("%d")
-                    url = f"{base_url_historical}{year}/{month}/{day}/traces/{icao_suffix}/trace_full_{icao}.json"
-                    urls.append((url, icao))
-                    current_date += delta
-
+        if recent:
+            # Use the single, fixed "recent" URL
+            return [(f"{base_url_recent}{icao[-2:]}/trace_full_{icao}.json", icao) for icao in self.aircraft_ids]
+
+        # Format the historical date paths once and reuse them for every aircraft
+        date_paths = pd.date_range(start_date, end_date, freq="D").strftime("%Y/%m/%d").tolist()
+        urls = [
+            (f"{base_url_historical}{date_path}/traces/{icao[-2:]}/trace_full_{icao}.json", icao)
+            for icao in self.aircraft_ids
+            for date_path in date_paths
+        ]
         return urls
 
 
 
-    def fetch_trace_data(self, url, icao):
-        """Fetch and return a trace DataFrame from a given URL."""
+    def _cache_path(self, url):
+        """Return the cache file path for a trace URL."""
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{digest}.json.gz")
+
+    def _cache_is_fresh(self, url, cache_path):
+        """Historical traces for past days are final; everything else expires after the TTL."""
+        match = re.search(r"/globe_history/(\d{4})/(\d{2})/(\d{2})/", url)
+        if match:
+            trace_date = date(*(int(part) for part in match.groups()))
+            if trace_date < datetime.now(pytz.utc).date():
+                return True
+        return time.time() - os.path.getmtime(cache_path) < self.CACHE_TTL_SECONDS
+
+    def _load_trace_bytes(self, url, icao):
+        """
+        Return (raw trace JSON bytes, whether they came from the disk cache) for a URL,
+        or (None, False) if there's nothing to fetch.
+        """
+        cache_path = self._cache_path(url) if self.cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                if self._cache_is_fresh(url, cache_path):
+                    with open(cache_path, "rb") as f:
+                        return gzip.decompress(f.read()), True
+            except (OSError, EOFError, zlib.error):
+                # A truncated or unreadable entry is dropped and downloaded again
+                try:
+                    os.remove(cache_path)
+                except OSError:
+                    pass
+
         headers = {"Referer": f"https://globe.adsbexchange.com/?icao={icao}"}
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            if data and "trace" in data:
-                trace_df = pd.DataFrame(data["trace"], columns=self.DEFAULT_COLUMNS)
-                trace_df = trace_df.drop(columns=self.DROP_COLUMNS, errors='ignore')
-                # Add additional metadata
-                trace_df["nnumber"] = data["r"]
-                trace_df["model"] = data["t"]
-                trace_df["desc"] = data["desc"]
-                # Convert the initial timestamp to a datetime
-                trace_df["timestamp"] = pd.to_datetime(data["timestamp"], unit="s")
-                # Compute the actual ping time by adding the offset
-                trace_df["ping_time"] = trace_df["timestamp"] + pd.to_timedelta(trace_df["time"], unit="s")
-                trace_df["icao"] = icao  # Add the aircraft id to the DataFrame
-                return trace_df
+        try:
+            response = self._session.get(url, headers=headers, timeout=self.REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"⚠️ Request failed for {url}: {e}")
+            return None, False
+        if response.status_code != 200:
+            return None, False
+        return response.content, False
+
+    def _store_trace_bytes(self, url, raw):
+        """Cache raw trace bytes for a URL; only called once they are known to parse."""
+        if not self.cache_dir or self._cache_write_failed:
+            return
+        tmp_path = None
+        try:
+            # Write to a temp file and rename so concurrent readers never see a partial file
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False) as tmp:
+                tmp_path = tmp.name
+                tmp.write(gzip.compress(raw))
+            os.replace(tmp_path, self._cache_path(url))
+        except OSError as e:
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            # The download itself succeeded, so carry on uncached rather than failing the fetch
+            if not self._cache_write_failed:
+                self._cache_write_failed = True
+                print(f"⚠️ Can't write to cache_dir {self.cache_dir}, continuing without caching: {e}")
+
+    def _discard_bad_trace(self, url, cached, error):
+        """
+        Handle trace bytes that failed to parse. A bad cache entry is removed and True is
+        returned so the caller can download a fresh copy; a bad download is reported and skipped.
+        """
+        if cached:
+            try:
+                os.remove(self._cache_path(url))
+            except FileNotFoundError:
+                pass
+            return True
+        print(f"⚠️ Invalid trace JSON from {url}: {error}")
+        return False
+
+    def _load_trace_json(self, url, icao):
+        """Return the parsed trace JSON for a URL, from the disk cache when possible."""
+        raw, cached = self._load_trace_bytes(url, icao)
+        if raw is None:
+            return None
+        try:
+            data = json_loads(raw)
+        except ValueError as e:
+            return self._load_trace_json(url, icao) if self._discard_bad_trace(url, cached, e) else None
+        if not cached:
+            self._store_trace_bytes(url, raw)
+        return data
+
+    @classmethod
+    def _build_trace_columns(cls, data, icao):
+        """Turn parsed trace JSON into (per-ping DataFrame, per-file metadata dict), or None if there's no data."""
+        if data and "trace" in data:
+            # Slice the trace rows into typed columns, never building the dropped ones
+            arr = np.asarray(data["trace"], dtype=object)
+            if arr.ndim != 2 or arr.shape[1] != len(cls.DEFAULT_COLUMNS):
+                # Ragged rows (older traces can stop short) are padded with NaN by the DataFrame constructor
+                arr = pd.DataFrame(data["trace"], columns=cls.DEFAULT_COLUMNS).to_numpy(dtype=object)
+            trace_df = pd.DataFrame({
+                col: arr[:, i] if cls.KEEP_DTYPES[col] is None else arr[:, i].astype(cls.KEEP_DTYPES[col])
+                for col, i in zip(cls.KEEP_COLUMNS, cls.KEEP_INDICES)
+            })
+            meta = {"nnumber": data["r"], "model": data["t"], "desc": data["desc"],
+                    "timestamp": data["timestamp"], "icao": icao}
+            return trace_df, meta
         return None
 
+    def _fetch_trace_columns(self, url, icao):
+        """Fetch a trace as (per-ping DataFrame, per-file metadata dict), or None if there's no data."""
+        return self._build_trace_columns(self._load_trace_json(url, icao), icao)
+
+    @staticmethod
+    def _attach_trace_metadata(trace_df, metas, lengths):
+        """Broadcast per-file metadata onto concatenated trace rows and compute ping_time."""
+        for col in ["nnumber", "model", "desc"]:
+            trace_df[col] = np.repeat(np.array([m[col] for m in metas], dtype=object), lengths)
+        # Convert the initial timestamps to datetimes
+        base = np.array([m["timestamp"] for m in metas], dtype="float64")
+        trace_df["timestamp"] = pd.to_datetime(np.repeat(base, lengths), unit="s")
+        # Compute the actual ping time by adding the offsets as rounded integer nanoseconds,
+        # exactly as process_flight_data does, so it can reuse the column
+        offset_ns = np.rint(trace_df["time"].to_numpy("float64") * 1_000_000_000).astype("int64")
+        trace_df["ping_time"] = trace_df["timestamp"].to_numpy("datetime64[ns]") + offset_ns.view("timedelta64[ns]")
+        trace_df["icao"] = np.repeat(np.array([m["icao"] for m in metas], dtype=object), lengths)
+        return trace_df
+
+    def fetch_trace_data(self, url, icao):
+        """Fetch and return a trace DataFrame from a given URL."""
+        fetched = self._fetch_trace_columns(url, icao)
+        if fetched is None:
+            return None
+        trace_df, meta = fetched
+        return self._attach_trace_metadata(trace_df, [meta], [len(trace_df)])
 
-    def get_traces(self, start_date=None, end_date=None, recent=False):
+
+    def get_traces(self, start_date=None, end_date=None, recent=False, max_workers=None, parse_processes=None):
         """
         Fetch trace data from ADSBExchange.
 
@@ -125,26 +366,75 @@ class FlightTracer:
         - start_date (date or None): Start date for fetching data. Ignored if recent=True.
         - end_date (date or None): End date for fetching data. Ignored if recent=True.
         - recent (bool): If True, fetches the most recent trace instead of historical data.
+        - max_workers (int or None): Concurrent downloads for this call; defaults to the instance's max_workers,
+          which it can lower but not raise, since the connection pool is sized to it.
+        - parse_processes (int or None): If set, parse downloaded JSON in this many worker processes
+          instead of the download threads. Worth it for large scans, especially from a warm cache.
 
         Returns:
         - DataFrame containing all collected flight traces.
         """
         urls = self.generate_urls(start_date, end_date, recent=recent)
-        traces = []
-        
-        for url, icao in urls:
-            print(f"Fetching data from: {url}")
-            trace_df = self.fetch_trace_data(url, icao)
-            
-            if trace_df is not None and not trace_df.empty:
-                traces.append(trace_df)
-                ts = pd.to_datetime(trace_df["timestamp"].iloc[0]).strftime('%b %-d, %Y')
+        results = {}
+
+        def collect(i, url, icao, fetched):
+            if fetched is not None and not fetched[0].empty:
+                results[i] = fetched
                 print(f"✅ Data found for {icao}.")
             else:
                 print(f"❌ No data for {icao} on {url}.")
-        
+
+        # No point starting more threads than there are files to fetch, or than the session has connections
+        workers = max(1, min(max_workers or self.max_workers, self.max_workers, len(urls)))
+        parser = ProcessPoolExecutor(max_workers=parse_processes) if parse_processes else None
+        fetch = self._load_trace_bytes if parser else self._fetch_trace_columns
+        parsing = {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for i, (url, icao) in enumerate(urls):
+                    print(f"Fetching data from: {url}")
+                    futures[executor.submit(fetch, url, icao)] = (i, url, icao)
+                for future in as_completed(futures):
+                    i, url, icao = futures[future]
+                    fetched = future.result()
+                    if parser:
+                        raw, cached = fetched
+                        if raw is not None:
+                            # JSON parsing holds the GIL, so it runs on other cores while downloads continue
+                            parsing[parser.submit(_parse_trace_bytes, raw, icao)] = (i, url, icao, raw, cached)
+                            continue
+                        fetched = None
+                    collect(i, url, icao, fetched)
+            for future in as_completed(parsing):
+                i, url, icao, raw, cached = parsing[future]
+                try:
+                    fetched = future.result()
+                except ValueError as e:
+                    # Re-download over a bad cache entry in this process; skip a bad download
+                    retry = self._discard_bad_trace(url, cached, e)
+                    fetched = self._fetch_trace_columns(url, icao) if retry else None
+                else:
+                    if not cached:
+                        self._store_trace_bytes(url, raw)
+                collect(i, url, icao, fetched)
+        finally:
+            if parser:
+                parser.shutdown()
+
+        # Keep the URL order so the output doesn't depend on download timing
+        traces = [results[i] for i in sorted(results)]
+
         if traces:
-            return pd.concat(traces).reset_index(drop=True).sort_values("timestamp")
+            # Per-file metadata is broadcast once over the combined rows rather than per file
+            out = pd.concat([trace_df for trace_df, _ in traces], ignore_index=True)
+            out = self._attach_trace_metadata(
+                out, [meta for _, meta in traces], [len(trace_df) for trace_df, _ in traces]
+            )
+            # Each file is already time-ordered, so a stable mergesort mostly walks sorted runs
+            out.sort_values("timestamp", kind="mergesort", inplace=True)
+            print(f"Collected {len(out):,} trace points.")
+            return out
         else:
             print("No valid trace data collected.")
             return pd.DataFrame()
@@ -152,39 +442,77 @@ class FlightTracer:
 
 
     def process_flight_data(self, df, mapping_info=None, filter_ground=True, threshold_seconds=3600, timezone=None):
-        df = df.sort_values(['icao', 'timestamp', 'time'])
-        df["time"] = pd.to_numeric(df["time"], errors="coerce")
-        df = df.dropna(subset=["time"])
-        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-        df["point_time"] = df["timestamp"] + pd.to_timedelta(df["time"], unit="s")
+        df = df.assign(time=pd.to_numeric(df["time"], errors="coerce")).dropna(subset=["time"])
+        if "ping_time" in df.columns and pd.api.types.is_datetime64_dtype(df["ping_time"]):
+            # Frames straight from get_traces (or raw Feather) already carry the ping times
+            df["point_time"] = df["ping_time"].to_numpy("datetime64[ns]")
+        else:
+            df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+            # Add the offsets as integer nanoseconds; far cheaper than pd.to_timedelta on floats
+            offset_ns = np.rint(df["time"].to_numpy("float64") * 1_000_000_000).astype("int64")
+            df["point_time"] = df["timestamp"].to_numpy("datetime64[ns]") + offset_ns.view("timedelta64[ns]")
+        # One stable sort on the absolute ping time covers both trace order and leg detection
+        df = df.sort_values(["icao", "point_time"], kind="mergesort")
         
         if timezone:
             try:
                 tz = pytz.timezone(timezone)
-                df["point_time_local"] = df["point_time"].dt.tz_localize("UTC").dt.tz_convert(tz)
             except Exception as e:
                 raise ValueError(f"Invalid timezone specified: {e}")
+            # Epoch nanoseconds with a tz-aware dtype are read as UTC instants, so there is
+            # nothing to localize or validate; the target zone is just attached to the values
+            utc_ns = df["point_time"].to_numpy("datetime64[ns]").view("i8")
+            df["point_time_local"] = pd.DatetimeIndex(utc_ns, dtype=pd.DatetimeTZDtype("ns", tz))
         
+        # Altitude mixes numbers with "ground"; as a category the ground filter is an integer compare
+        df["altitude"] = df["altitude"].astype("category")
+        altitude_categories = df["altitude"].cat.categories
+        if "ground" in altitude_categories:
+            ground = df["altitude"].cat.codes.to_numpy() == altitude_categories.get_loc("ground")
+        else:
+            ground = np.zeros(len(df), dtype=bool)
+
         if "details" in df.columns:
-            details_df = pd.json_normalize(df["details"], errors="ignore")
-            if "flight" in details_df.columns:
-                df["call_sign"] = details_df["flight"].str.strip().ffill().fillna("UNKNOWN")
-            else:
-                df["call_sign"] = "UNKNOWN"
-            overlapping_cols = details_df.columns.intersection(df.columns).tolist()
-            details_df = details_df.drop(columns=overlapping_cols, errors="ignore")
-            df = df.drop(columns=["details"]).join(details_df, how="left")
+            # Only the flight field of the details dicts is used; it forward-fills across every ping
+            flights = pd.Series(
+                [d.get("flight") if isinstance(d, dict) else None for d in df["details"].tolist()],
+                index=df.index, dtype=object,
+            )
+            df["call_sign"] = flights.str.strip().ffill().fillna("UNKNOWN")
+            df = df.drop(columns=["details"])
         else:
             df["call_sign"] = "UNKNOWN"
 
-        df["time_diff"] = df.groupby(["icao", "call_sign"])["point_time"].diff().dt.total_seconds()
-        df["new_leg"] = (df["time_diff"] > threshold_seconds).astype(int)
-        df["leg_id"] = df.groupby(["icao", "call_sign"])["new_leg"].cumsum() + 1
-        df["flight_leg"] = df["call_sign"].fillna("UNKNOWN") + "_leg" + df["leg_id"].astype(str)
+        # Legs split on gaps longer than threshold_seconds within each (icao, call_sign)
+        icao_codes, _ = pd.factorize(df["icao"])
+        call_sign_codes, call_sign_uniques = pd.factorize(df["call_sign"])
+        group_keys = icao_codes.astype(np.int64) * (len(call_sign_uniques) + 1) + call_sign_codes
+        times_ns = df["point_time"].to_numpy("datetime64[ns]").view("i8")
+        df["leg_id"] = _compute_leg_ids(group_keys, times_ns, int(threshold_seconds * 1_000_000_000))
+        # Format each distinct (call_sign, leg_id) label once and expand it through categorical codes;
+        # sorted categories keep sorting and grouping on flight_leg lexicographic
+        leg_ids = df["leg_id"].to_numpy()
+        leg_stride = int(leg_ids.max()) + 1 if len(leg_ids) else 1
+        leg_codes, leg_uniques = pd.factorize(call_sign_codes.astype(np.int64) * leg_stride + leg_ids)
+        leg_labels = (
+            pd.Index(call_sign_uniques[leg_uniques // leg_stride]).astype(str)
+            + "_leg" + pd.Index(leg_uniques % leg_stride).astype(str)
+        )
+        df["flight_leg"] = pd.Categorical.from_codes(leg_codes, categories=leg_labels).reorder_categories(
+            leg_labels.sort_values()
+        )
+        df["icao"] = df["icao"].astype("category")
+        df["call_sign"] = df["call_sign"].astype("category")
         
-        if filter_ground:
-            df = df.query('altitude != "ground"').copy()
+        if filter_ground and ground.any():
+            df = df[~ground].copy()
+            # Drop categories only the ground rows used so groupbys never see empty groups
+            for col in ["altitude", "icao", "call_sign", "flight_leg"]:
+                df[col] = df[col].cat.remove_unused_categories()
         
+        # Speed and heading don't need float64; traces fetched with get_traces already carry float32
+        df = df.astype({"ground_speed": "float32", "heading": "float32"})
+
         output_columns = [
             "point_time", "altitude", "ground_speed", "heading", "lat", "lon",
             "icao", "call_sign", "leg_id", "flight_leg"
@@ -192,10 +520,9 @@ class FlightTracer:
         if "point_time_local" in df.columns:
             output_columns.append("point_time_local")
         
-        return gpd.GeoDataFrame(
-            df[output_columns],
-            geometry=gpd.points_from_xy(df.lon, df.lat)
-        ).set_crs(epsg=4326)
+        # Build every point in one vectorized GEOS call
+        geometry = shapely.points(df["lon"].to_numpy(), df["lat"].to_numpy())
+        return gpd.GeoDataFrame(df[output_columns], geometry=geometry, crs="EPSG:4326")
 
 
     
@@ -218,25 +545,28 @@ class FlightTracer:
         if point_time_column not in gdf.columns:
             raise KeyError(f"Expected column '{point_time_column}' not found in DataFrame.")
 
-        legs = []
-        for flight_leg, group in gdf.groupby(flight_leg_column):
-            group = group.sort_values(point_time_column)  # Ensure chronological order
-            points = list(group.geometry)
-            geometry = LineString(points) if len(points) > 1 else points[0]
-
-            # Handle missing columns
-            row_data = {
-                flight_leg_column: flight_leg,
-                "icao": group["icao"].iloc[0] if "icao" in group.columns else None,
-                "call_sign": group["call_sign"].iloc[0] if "call_sign" in group.columns else None,
-                "flight_date_pst": group["flight_date_pst"].iloc[0] if "flight_date_pst" in group.columns else None,
-                "leg_id": group["leg_id"].iloc[0] if "leg_id" in group.columns else None,
-                "geometry": geometry
-            }
-
-            legs.append(row_data)
-
-        gdf_lines = gpd.GeoDataFrame(legs, crs=gdf.crs)
+        # Put each leg's points together in chronological order, then build every
+        # geometry from the flat coordinate arrays in one vectorized call
+        ordered = gdf.dropna(subset=[flight_leg_column])
+        ordered = ordered.sort_values([flight_leg_column, point_time_column], kind="mergesort")
+        leg_codes, legs = pd.factorize(ordered[flight_leg_column])
+        counts = np.bincount(leg_codes, minlength=len(legs))
+        starts = np.cumsum(counts) - counts
+        coords = np.column_stack([ordered.geometry.x.to_numpy(), ordered.geometry.y.to_numpy()])
+
+        # Single-point legs stay points; legs with more pings become lines
+        geometry = shapely.points(coords[starts])
+        in_line = (counts > 1)[leg_codes]
+        if in_line.any():
+            shapely.linestrings(coords[in_line], indices=leg_codes[in_line], out=geometry)
+
+        # Handle missing columns; attributes come from each leg's first ping
+        first = ordered.iloc[starts]
+        row_data = {flight_leg_column: legs.to_numpy()}
+        for col in ["icao", "call_sign", "flight_date_pst", "leg_id"]:
+            row_data[col] = first[col].to_numpy() if col in first.columns else None
+
+        gdf_lines = gpd.GeoDataFrame(row_data, geometry=geometry, crs=gdf.crs)
         return gdf_lines
 
 
@@ -244,24 +574,41 @@ class FlightTracer:
 
 
 
+    @staticmethod
+    def _split_altitude(gdf):
+        """
+        Return gdf with altitude as nullable integer feet plus a boolean on_ground column.
+        File formats give each field one type, so "ground" can't share a column with numbers.
+        """
+        if "altitude" not in gdf.columns:
+            return gdf
+        altitude = gdf["altitude"].astype(object)
+        on_ground = altitude.eq("ground")
+        return gdf.assign(
+            altitude=pd.to_numeric(altitude.mask(on_ground), errors="coerce").convert_dtypes(),
+            on_ground=on_ground,
+        )
+
     def export_flight_data(self, gdf, base_path, export_format="geojson"):
         """
-        Export flight data as GeoJSON or Shapefile.
+        Export flight data as GeoJSON, FlatGeobuf or Shapefile.
 
         Parameters:
         gdf (GeoDataFrame): The GeoDataFrame of flight points.
         base_path (str): The base path for saving the files.
-        export_format (str): Either "geojson" (default) or "shp".
+        export_format (str): "geojson" (default), "fgb" (FlatGeobuf, smaller and faster) or "shp".
         """
-        if export_format == "geojson":
-            point_file = f"{base_path}_points.geojson"
-            line_file = f"{base_path}_lines.geojson"
-            gdf.to_file(point_file, driver="GeoJSON")
-            print(f"GeoJSON exported: {point_file}")
+        gdf = self._split_altitude(gdf)
+        if export_format in ("geojson", "fgb"):
+            driver = "GeoJSON" if export_format == "geojson" else "FlatGeobuf"
+            point_file = f"{base_path}_points.{export_format}"
+            line_file = f"{base_path}_lines.{export_format}"
+            gdf.to_file(point_file, driver=driver, engine="pyogrio")
+            print(f"{driver} exported: {point_file}")
 
             gdf_lines = self.create_linestrings(gdf, flight_leg_column="flight_leg")
-            gdf_lines.to_file(line_file, driver="GeoJSON")
-            print(f"GeoJSON exported: {line_file}")
+            gdf_lines.to_file(line_file, driver=driver, engine="pyogrio")
+            print(f"{driver} exported: {line_file}")
 
         elif export_format == "shp":
             shp_dir = f"{base_path}_shp"
@@ -295,7 +642,7 @@ class FlightTracer:
                 if col in gdf.columns:
                     gdf[col] = gdf[col].astype(str)
 
-            gdf.to_file(point_file, driver="ESRI Shapefile")
+            gdf.to_file(point_file, driver="ESRI Shapefile", engine="pyogrio")
             print(f"Shapefile exported: {point_file}")
 
             # Use the correct column name for grouping in create_linestrings()
@@ -304,16 +651,17 @@ class FlightTracer:
 
             # Process LineStrings using the correct column
             gdf_lines = self.create_linestrings(gdf, flight_leg_column, point_time_column)
-            gdf_lines.to_file(line_file, driver="ESRI Shapefile")
+            gdf_lines.to_file(line_file, driver="ESRI Shapefile", engine="pyogrio")
             print(f"Shapefile exported: {line_file}")
 
         else:
-            raise ValueError("Unsupported export format. Use 'geojson' or 'shp'.")
+            raise ValueError("Unsupported export format. Use 'geojson', 'fgb' or 'shp'.")
 
 
 
 
-    def plot_flights(self, gdf, geometry_type='points', figsize=(10,10), pad_factor=0.2, zoom=None, fig_filename=None):
+    def plot_flights(self, gdf, geometry_type='points', figsize=(10,10), pad_factor=0.2, zoom=None, fig_filename=None,
+                     plot_engine='auto'):
         """
         Plot flight activity from a GeoDataFrame with a basemap, coloring different flight legs distinctly.
         
@@ -324,7 +672,16 @@ class FlightTracer:
         pad_factor (float): Fraction by which to expand the bounds for additional context.
         zoom (int or None): Optional zoom level override for the basemap.
         fig_filename (str or None): If provided, the plot will be saved to this PNG file.
+        plot_engine (str): How points are drawn: 'matplotlib' (a marker per point), 'datashader'
+            (one rasterized image; requires datashader) or 'auto' (datashader above
+            DATASHADER_MIN_POINTS points when it's installed). Lines always use matplotlib.
         """
+        if plot_engine not in ('auto', 'matplotlib', 'datashader'):
+            raise ValueError("plot_engine must be 'auto', 'matplotlib' or 'datashader'")
+        if plot_engine == 'datashader' and ds is None:
+            raise ImportError(
+                "plot_engine='datashader' requires the datashader package: pip install 'flight-tracer[datashader]'"
+            )
         if gdf.crs is None:
             gdf = gdf.set_crs(epsg=4326)
         gdf_plot = gdf.to_crs(epsg=3857)
@@ -336,23 +693,35 @@ class FlightTracer:
         norm = mcolors.Normalize(vmin=0, vmax=len(unique_legs))
         colors = {leg: cmap(norm(i)) for i, leg in enumerate(unique_legs)}
         
+        xmin, ymin, xmax, ymax = gdf_plot.total_bounds
+        x_pad = (xmax - xmin) * pad_factor
+        y_pad = (ymax - ymin) * pad_factor
+        extent = [xmin - x_pad, ymin - y_pad, xmax + x_pad, ymax + y_pad]
+        
         if geometry_type == 'points':
-            for leg, group in gdf_plot.groupby("flight_leg"):
-                group.plot(ax=ax, marker='o', color=colors[leg], markersize=5, label=leg)
+            if plot_engine == 'auto':
+                use_datashader = ds is not None and len(gdf_plot) > FlightTracer.DATASHADER_MIN_POINTS
+            else:
+                use_datashader = plot_engine == 'datashader'
+            if use_datashader:
+                FlightTracer._shade_points(ax, gdf_plot, colors, extent, figsize)
+            else:
+                for leg, group in gdf_plot.groupby("flight_leg", observed=True):
+                    group.plot(ax=ax, marker='o', color=colors[leg], markersize=5, label=leg)
         elif geometry_type == 'lines':
-            for leg, group in gdf_plot.groupby("flight_leg"):
+            for leg, group in gdf_plot.groupby("flight_leg", observed=True):
                 group.plot(ax=ax, linewidth=2, color=colors[leg], label=leg)
         else:
             raise ValueError("geometry_type must be either 'points' or 'lines'")
         
-        xmin, ymin, xmax, ymax = gdf_plot.total_bounds
-        x_pad = (xmax - xmin) * pad_factor
-        y_pad = (ymax - ymin) * pad_factor
-        extent = [xmin - x_pad, ymin - y_pad, xmax + x_pad, ymax + y_pad]
-        
         ax.set_xlim(extent[0], extent[2])
         ax.set_ylim(extent[1], extent[3])
         
+        # The CLI calls this unbound (self is None), so fall back to the default cache location
+        cache_dir = getattr(self, "cache_dir", FlightTracer.DEFAULT_CACHE_DIR)
+        if cache_dir:
+            # contextily otherwise caches tiles in a temporary directory dropped at exit
+            ctx.set_cache_dir(os.path.join(cache_dir, "tiles"))
         if zoom is not None:
             ctx.add_basemap(ax, source=ctx.providers.CartoDB.Positron, zoom=zoom, reset_extent=False)
         else:
@@ -371,30 +740,115 @@ class FlightTracer:
         plt.show()
 
 
-    def upload_to_s3(self, gdf, bucket_name, csv_object_name, geojson_object_name):
-        """Upload the GeoDataFrame as both CSV and GeoJSON to S3 (if configured)."""
+    @staticmethod
+    def _shade_points(ax, gdf_plot, colors, extent, figsize, dpi=200):
+        """Rasterize points with datashader into a single image colored by flight leg."""
+        legs = gdf_plot["flight_leg"].astype("category").cat.remove_unused_categories()
+        points = pd.DataFrame({
+            "x": gdf_plot.geometry.x.to_numpy(),
+            "y": gdf_plot.geometry.y.to_numpy(),
+            "leg_code": legs.cat.codes.to_numpy(dtype="float32"),
+        })
+        canvas = ds.Canvas(
+            plot_width=int(figsize[0] * dpi), plot_height=int(figsize[1] * dpi),
+            x_range=(extent[0], extent[2]), y_range=(extent[1], extent[3]),
+        )
+        # One 2-D layer holding a leg code per pixel; count_cat would allocate a full layer per leg
+        agg = canvas.points(points, "x", "y", agg=ds.max("leg_code"))
+        # Color pixels through a per-leg RGBA lookup table, packed the way datashader images are
+        lut = np.array([mcolors.to_rgba(colors[leg], alpha=1) for leg in legs.cat.categories]) * 255
+        lut = lut.round().astype(np.uint32)
+        lut = lut[:, 0] | lut[:, 1] << 8 | lut[:, 2] << 16 | lut[:, 3] << 24
+        codes = agg.values
+        filled = ~np.isnan(codes)
+        packed = np.zeros(codes.shape, dtype=np.uint32)
+        packed[filled] = lut[codes[filled].astype(np.int64)]
+        img = tf.spread(tf.Image(packed, coords=agg.coords, dims=agg.dims), px=1)
+        # Draw above the basemap, which contextily adds later at the default image zorder
+        ax.imshow(img.to_pil(), extent=(extent[0], extent[2], extent[1], extent[3]), zorder=2)
+        # The raster has no per-leg artists, so add empty ones for the legend
+        for leg in legs.cat.categories:
+            ax.scatter([], [], marker='o', color=colors[leg], s=5, label=leg)
+
+
+    def _upload_buffer(self, buffer, bucket_name, object_name, content_type, transfer_config, compress=False):
+        """Upload an in-memory buffer to S3, optionally zstd-compressed on the fly. Returns the key used."""
+        buffer.seek(0)
+        extra_args = {"ContentType": content_type}
+        if compress:
+            if zstd is None:
+                raise ImportError("compress=True requires the zstandard package: pip install 'flight-tracer[compress]'")
+            buffer = zstd.ZstdCompressor(level=3, threads=-1).stream_reader(buffer)
+            object_name = f"{object_name}.zst"
+            extra_args["ContentEncoding"] = "zstd"
+        self.s3_client.upload_fileobj(buffer, bucket_name, object_name, ExtraArgs=extra_args, Config=transfer_config)
+        return object_name
+
+    def upload_to_s3(self, gdf, bucket_name, csv_object_name, geojson_object_name, parquet_object_name=None,
+                     compress=False):
+        """Upload the GeoDataFrame as both CSV and GeoJSON to S3 (if configured).
+
+        If parquet_object_name is given, a GeoParquet copy with a bbox covering
+        column is uploaded as well. With compress=True the CSV and GeoJSON are
+        zstd-compressed and stored under their names plus ".zst" (requires the
+        zstandard package).
+        """
         if not self.s3_client:
             print("S3 client not configured; skipping upload.")
             return
         
-        # Save CSV in memory and upload
+        # Multipart uploads in parallel parts once a body passes 8 MB
+        transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=8
+        )
+
+        # Build every payload before uploading anything, so a serialization error can't leave a partial upload
         csv_buffer = BytesIO()
         gdf.to_csv(csv_buffer, index=False)
-        csv_buffer.seek(0)
-        self.s3_client.put_object(Bucket=bucket_name, Key=csv_object_name, Body=csv_buffer.getvalue())
-        print(f"✅ CSV uploaded to s3://{bucket_name}/{csv_object_name}")
-        
+
         # Convert timestamp columns to ISO 8601 strings for JSON serialization
-        gdf_json = gdf.copy()
-        for col in gdf_json.select_dtypes(include=["datetime64"]).columns:
-            gdf_json[col] = gdf_json[col].dt.strftime('%Y-%m-%dT%H:%M:%S')
+        iso_columns = {}
+        for col in gdf.select_dtypes(include=["datetime64"]).columns:
+            # datetime_as_string emits the same '%Y-%m-%dT%H:%M:%S' text without per-row strftime
+            seconds = gdf[col].to_numpy("datetime64[s]")
+            iso_strings = np.datetime_as_string(seconds, unit="s").astype(object)
+            iso_strings[np.isnat(seconds)] = None
+            iso_columns[col] = iso_strings
+        # The index becomes each feature's "id", as GeoDataFrame.to_json writes it
+        iso_columns["__feature_id"] = gdf.index.astype(str)
+        # assign swaps in just those columns; the rest, geometry included, aren't copied. Without a
+        # CRS GDAL skips the top-level "crs" member, matching to_json output
+        gdf_typed = self._split_altitude(gdf)
+        gdf_json = gdf_typed.assign(**iso_columns).set_crs(None, allow_override=True)
+
+        # Let GDAL write the features straight into a buffer rather than building one big JSON string
+        geojson_buffer = BytesIO()
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="'crs' was not provided")
+            pyogrio.write_dataframe(
+                gdf_json, geojson_buffer, driver="GeoJSON",
+                layer_options={"ID_FIELD": "__feature_id", "WRITE_NAME": "NO"},
+            )
 
-        # Drop non-serializable columns before exporting to GeoJSON
-        geojson_str = gdf_json.to_json()
-        
-        self.s3_client.put_object(
-            Bucket=bucket_name, 
-            Key=geojson_object_name, 
-            Body=geojson_str.encode('utf-8')
+        if parquet_object_name:
+            # Binary columnar copy; the bbox column lets readers skip row groups by extent.
+            # Arrow columns need one type, so it takes the same split altitude as the GeoJSON
+            parquet_buffer = BytesIO()
+            gdf_typed.to_parquet(parquet_buffer, write_covering_bbox=True, compression="zstd")
+
+        csv_key = self._upload_buffer(csv_buffer, bucket_name, csv_object_name, "text/csv", transfer_config, compress)
+        print(f"✅ CSV uploaded to s3://{bucket_name}/{csv_key}")
+
+        geojson_key = self._upload_buffer(
+            geojson_buffer, bucket_name, geojson_object_name, "application/geo+json", transfer_config, compress
         )
-        print(f"✅ GeoJSON uploaded to s3://{bucket_name}/{geojson_object_name}")
\ No newline at end of file
+        print(f"✅ GeoJSON uploaded to s3://{bucket_name}/{geojson_key}")
+
+        if parquet_object_name:
+            # Parquet is already zstd-compressed internally, so it is never wrapped again
+            self._upload_buffer(
+                parquet_buffer, bucket_name, parquet_object_name, "application/vnd.apache.parquet", transfer_config
+            )
+            print(f"✅ GeoParquet uploaded to s3://{bucket_name}/{parquet_object_name}")
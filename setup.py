@@ -21,10 +21,18 @@ setup(
         "boto3",
         "matplotlib",
         "contextily",
-        "shapely",
+        "shapely>=2.0",
+        "pyogrio",
+        "orjson",
         "click",
-        "pytz"
+        "pytz",
+        "pyarrow"
     ],
+    extras_require={
+        "compress": ["zstandard"],
+        "fast": ["numba"],
+        "datashader": ["datashader"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: Public Domain",
@@ -0,0 +1,40 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+import pandas as pd
+from flight_tracer import FlightTracer
+from flight_tracer.cli import read_raw, write_raw
+
+class TestRawFiles(unittest.TestCase):
+    TRACE_JSON = {
+        "r": "N123", "t": "B738", "desc": "BOEING 737-800", "timestamp": 1738886400.0,
+        "trace": [
+            [0.5, 34.1, -118.2, "ground", None, None, 0, None, {"flight": "UAL1 "}, None, None, None, None, None],
+            [10.0, 34.2, -118.3, 1500, 120.3, 90.1, 0, 64, None, "adsb_icao", 1550, None, None, None],
+            [20.0, 34.3, -118.4, None, 121.0, 90.4, 0, 64, {"flight": "UAL1 "}, "adsb_icao", 1600, None, None, None],
+        ],
+    }
+
+    def test_feather_round_trip_processes_like_the_fetched_frame(self):
+        tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=None)
+        response = mock.Mock(status_code=200, content=json.dumps(self.TRACE_JSON).encode())
+        with mock.patch.object(tracer._session, "get", return_value=response):
+            raw_df = tracer.get_traces(date(2025, 2, 7), date(2025, 2, 7))
+
+        with tempfile.TemporaryDirectory() as out_dir:
+            path = os.path.join(out_dir, "raw_abc123.feather")
+            write_raw(raw_df, path)
+            restored = read_raw(path)
+
+        self.assertEqual(restored["altitude"].tolist(), ["ground", 1500, None])
+        self.assertEqual(restored["details"].tolist(), raw_df["details"].tolist())
+        pd.testing.assert_frame_equal(
+            FlightTracer.process_flight_data(None, restored, filter_ground=False),
+            FlightTracer.process_flight_data(None, raw_df, filter_ground=False),
+        )
+
+if __name__ == '__main__':
+    unittest.main()
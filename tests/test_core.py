@@ -1,6 +1,16 @@
+import gzip
+import json
+import os
+import tempfile
 import unittest
 from datetime import date
+from io import BytesIO
+from unittest import mock
+import numpy as np
+import pandas as pd
+import geopandas as gpd
 from flight_tracer import FlightTracer
+from flight_tracer import core
 
 class TestFlightTracer(unittest.TestCase):
     def test_generate_urls_single_day(self):
@@ -21,5 +31,313 @@ class TestFlightTracer(unittest.TestCase):
         # Expect 2 URLs (one for each day)
         self.assertEqual(len(urls), 2)
 
+    def test_get_traces_keeps_url_order(self):
+        tracer = FlightTracer(aircraft_ids=["0d086e", "a11f59"])
+
+        def fake_fetch(url, icao):
+            # Same timestamp for every file, so only the URL order decides the result order
+            meta = {"nnumber": "N1", "model": "B738", "desc": "", "timestamp": 1735689600.0, "icao": icao}
+            return pd.DataFrame({"time": [0.0]}), meta
+
+        with mock.patch.object(tracer, "_fetch_trace_columns", side_effect=fake_fetch):
+            df = tracer.get_traces(date(2025, 1, 1), date(2025, 1, 2))
+        self.assertEqual(df["icao"].tolist(), ["0d086e", "0d086e", "a11f59", "a11f59"])
+
+    def test_get_traces_caps_workers_at_pool_size(self):
+        tracer = FlightTracer(aircraft_ids=["0d086e", "a11f59"], max_workers=2)
+        with mock.patch.object(tracer, "_fetch_trace_columns", return_value=None), \
+                mock.patch.object(core, "ThreadPoolExecutor", wraps=core.ThreadPoolExecutor) as pool:
+            tracer.get_traces(date(2025, 1, 1), date(2025, 1, 5), max_workers=16)
+        pool.assert_called_once_with(max_workers=2)
+
+    TRACE_JSON = {
+        "r": "N123", "t": "B738", "desc": "BOEING 737-800", "timestamp": 1738886400.0,
+        "trace": [
+            [0.5, 34.1, -118.2, "ground", None, None, 0, None, {"flight": "UAL1 "}, None, None, None, None, None],
+            [10.0, 34.2, -118.3, 1500, 120.3, 90.1, 0, 64, None, "adsb_icao", 1550, None, None, None],
+        ],
+    }
+
+    def test_fetch_trace_data_builds_columns(self):
+        tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=None)
+        response = mock.Mock(status_code=200, content=json.dumps(self.TRACE_JSON).encode())
+        with mock.patch.object(tracer._session, "get", return_value=response):
+            df = tracer.fetch_trace_data("https://example.com/trace.json", "abc123")
+
+        self.assertEqual(len(df), 2)
+        for col in FlightTracer.DROP_COLUMNS:
+            self.assertNotIn(col, df.columns)
+        self.assertEqual(df["altitude"].tolist(), ["ground", 1500])
+        self.assertEqual(df["ping_time"].iloc[1], pd.Timestamp("2025-02-07 00:00:10"))
+
+    def test_fetch_trace_data_pads_short_rows(self):
+        data = dict(self.TRACE_JSON, trace=[self.TRACE_JSON["trace"][0][:9], self.TRACE_JSON["trace"][1]])
+        tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=None)
+        response = mock.Mock(status_code=200, content=json.dumps(data).encode())
+        with mock.patch.object(tracer._session, "get", return_value=response):
+            df = tracer.fetch_trace_data("https://example.com/trace.json", "abc123")
+
+        self.assertEqual(df["lat"].tolist(), [34.1, 34.2])
+        self.assertTrue(np.isnan(df["alt_geom"].iloc[0]))
+        self.assertEqual(df["alt_geom"].iloc[1], 1550)
+
+    def test_get_traces_parses_in_worker_processes(self):
+        tracer = FlightTracer(aircraft_ids=["abc123", "def456"], cache_dir=None)
+        response = mock.Mock(status_code=200, content=json.dumps(self.TRACE_JSON).encode())
+        with mock.patch.object(tracer._session, "get", return_value=response):
+            threaded = tracer.get_traces(date(2025, 2, 7), date(2025, 2, 8))
+            pooled = tracer.get_traces(date(2025, 2, 7), date(2025, 2, 8), parse_processes=2)
+        pd.testing.assert_frame_equal(threaded, pooled)
+
+    def test_fetch_trace_data_reuses_cached_history(self):
+        url = "https://globe.adsbexchange.com/globe_history/2025/02/07/traces/23/trace_full_abc123.json"
+        response = mock.Mock(status_code=200, content=json.dumps(self.TRACE_JSON).encode())
+        with tempfile.TemporaryDirectory() as cache_dir:
+            tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=cache_dir)
+            with mock.patch.object(tracer._session, "get", return_value=response) as get:
+                first = tracer.fetch_trace_data(url, "abc123")
+                second = tracer.fetch_trace_data(url, "abc123")
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(first["lat"].tolist(), second["lat"].tolist())
+
+    def test_process_flight_data_splits_legs_on_time_gaps(self):
+        base = pd.Timestamp("2025-02-07")
+        raw_df = pd.DataFrame({
+            "time": [0.0, 60.0, 5000.0, 5060.0, 30.0],
+            "lat": [34.0, 34.1, 34.2, 34.3, 40.0],
+            "lon": [-118.0, -118.1, -118.2, -118.3, -100.0],
+            "altitude": [1000, 1100, "ground", 1300, 2000],
+            "ground_speed": [100.0] * 5,
+            "heading": [90.0] * 5,
+            "timestamp": [base] * 5,
+            "icao": ["abc123", "abc123", "abc123", "abc123", "def456"],
+        })
+        gdf = FlightTracer.process_flight_data(None, raw_df, filter_ground=False)
+
+        self.assertEqual(gdf["icao"].tolist(), ["abc123"] * 4 + ["def456"])
+        self.assertEqual(gdf["leg_id"].tolist(), [1, 1, 2, 2, 1])
+        self.assertEqual(gdf["flight_leg"].tolist()[:3], ["UNKNOWN_leg1", "UNKNOWN_leg1", "UNKNOWN_leg2"])
+
+        filtered = FlightTracer.process_flight_data(None, raw_df, filter_ground=True)
+        self.assertEqual(len(filtered), 4)
+        self.assertEqual(filtered["flight_leg"].cat.categories.tolist(), ["UNKNOWN_leg1", "UNKNOWN_leg2"])
+
+    def test_create_linestrings_builds_one_geometry_per_leg(self):
+        raw_df = pd.DataFrame({
+            "time": [0.0, 60.0, 120.0, 9000.0],
+            "lat": [34.0, 34.1, 34.2, 35.0],
+            "lon": [-118.0, -118.1, -118.2, -119.0],
+            "altitude": [1000, 1100, 1200, 1300],
+            "ground_speed": [100.0] * 4,
+            "heading": [90.0] * 4,
+            "timestamp": [pd.Timestamp("2025-02-07")] * 4,
+            "icao": ["abc123"] * 4,
+        })
+        gdf = FlightTracer.process_flight_data(None, raw_df)
+        lines = FlightTracer.create_linestrings(None, gdf)
+
+        self.assertEqual(lines["flight_leg"].tolist(), ["UNKNOWN_leg1", "UNKNOWN_leg2"])
+        self.assertEqual(lines.geometry.geom_type.tolist(), ["LineString", "Point"])
+        self.assertEqual(list(lines.geometry.iloc[0].coords), [(-118.0, 34.0), (-118.1, 34.1), (-118.2, 34.2)])
+        self.assertEqual(lines.crs, gdf.crs)
+
+    def test_fetch_trace_data_does_not_cache_unparseable_body(self):
+        url = "https://globe.adsbexchange.com/globe_history/2025/02/07/traces/23/trace_full_abc123.json"
+        html = mock.Mock(status_code=200, content=b"<html>Too many requests</html>")
+        good = mock.Mock(status_code=200, content=json.dumps(self.TRACE_JSON).encode())
+        with tempfile.TemporaryDirectory() as cache_dir:
+            tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=cache_dir)
+            with mock.patch.object(tracer._session, "get", side_effect=[html, good]) as get:
+                self.assertIsNone(tracer.fetch_trace_data(url, "abc123"))
+                self.assertEqual(len(tracer.fetch_trace_data(url, "abc123")), 2)
+                self.assertEqual(len(tracer.fetch_trace_data(url, "abc123")), 2)
+        self.assertEqual(get.call_count, 2)
+
+    def test_unwritable_cache_dir_does_not_fail_the_fetch(self):
+        response = mock.Mock(status_code=200, content=json.dumps(self.TRACE_JSON).encode())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # A regular file where the cache directory should be makes every cache write fail
+            cache_dir = os.path.join(tmp_dir, "not_a_dir")
+            open(cache_dir, "w").close()
+            tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=cache_dir)
+            with mock.patch.object(tracer._session, "get", return_value=response):
+                df = tracer.get_traces(date(2025, 2, 7), date(2025, 2, 8))
+            self.assertEqual(os.listdir(tmp_dir), ["not_a_dir"])
+        self.assertEqual(len(df), 4)
+
+    def test_failed_cache_rename_leaves_no_temp_file(self):
+        url = "https://globe.adsbexchange.com/globe_history/2025/02/07/traces/23/trace_full_abc123.json"
+        response = mock.Mock(status_code=200, content=json.dumps(self.TRACE_JSON).encode())
+        with tempfile.TemporaryDirectory() as cache_dir:
+            tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=cache_dir)
+            with mock.patch.object(tracer._session, "get", return_value=response), \
+                    mock.patch.object(core.os, "replace", side_effect=PermissionError):
+                self.assertEqual(len(tracer.fetch_trace_data(url, "abc123")), 2)
+            self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_corrupt_cache_entry_is_refetched(self):
+        response = mock.Mock(status_code=200, content=json.dumps(self.TRACE_JSON).encode())
+        with tempfile.TemporaryDirectory() as cache_dir:
+            tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=cache_dir)
+            bad_entries = [
+                gzip.compress(b"<html>Too many requests</html>"),
+                gzip.compress(json.dumps(self.TRACE_JSON).encode())[:40],  # truncated write
+                b"not gzip at all",
+            ]
+            for entry in bad_entries:
+                for parse_processes in (None, 2):
+                    for url, _ in tracer.generate_urls(date(2025, 2, 7), date(2025, 2, 7)):
+                        with open(tracer._cache_path(url), "wb") as f:
+                            f.write(entry)
+                    with mock.patch.object(tracer._session, "get", return_value=response) as get:
+                        df = tracer.get_traces(date(2025, 2, 7), date(2025, 2, 7), parse_processes=parse_processes)
+                    self.assertEqual(len(df), 2)
+                    self.assertEqual(get.call_count, 1)
+
+    def _ground_frame(self):
+        raw_df = pd.DataFrame({
+            "time": [0.0, 60.0, 120.0],
+            "lat": [34.0, 34.1, 34.2],
+            "lon": [-118.0, -118.1, -118.2],
+            "altitude": [1000, "ground", 1200],
+            "ground_speed": [100.0] * 3,
+            "heading": [90.0] * 3,
+            "timestamp": [pd.Timestamp("2025-02-07")] * 3,
+            "icao": ["abc123"] * 3,
+        })
+        return FlightTracer.process_flight_data(None, raw_df, filter_ground=False)
+
+    def test_upload_to_s3_geojson_matches_to_json(self):
+        gdf = self._ground_frame()
+        tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=None)
+        tracer.s3_client = mock.Mock()
+        bodies = {}
+
+        def capture(buffer, bucket_name, object_name, *args, **kwargs):
+            bodies[object_name] = buffer.getvalue()
+            return object_name
+
+        with mock.patch.object(tracer, "_upload_buffer", side_effect=capture):
+            tracer.upload_to_s3(gdf, "bucket", "traces.csv", "traces.geojson")
+
+        expected = json.loads(gdf.assign(
+            point_time=gdf["point_time"].dt.strftime("%Y-%m-%dT%H:%M:%S"),
+            altitude=[1000, None, 1200],
+            on_ground=[False, True, False],
+        ).to_json())
+        self.assertEqual(json.loads(bodies["traces.geojson"]), expected)
+
+    def test_upload_to_s3_writes_parquet_with_ground_pings(self):
+        gdf = self._ground_frame()
+        tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=None)
+        tracer.s3_client = mock.Mock()
+        bodies = {}
+        tracer.s3_client.upload_fileobj.side_effect = (
+            lambda buffer, bucket, key, **kwargs: bodies.setdefault(key, buffer.read())
+        )
+        tracer.upload_to_s3(gdf, "bucket", "traces.csv", "traces.geojson", parquet_object_name="traces.parquet")
+
+        self.assertEqual(list(bodies), ["traces.csv", "traces.geojson", "traces.parquet"])
+        parquet = gpd.read_parquet(BytesIO(bodies["traces.parquet"]))
+        self.assertEqual(parquet["altitude"].tolist()[::2], [1000, 1200])
+        self.assertTrue(pd.isna(parquet["altitude"].iloc[1]))
+        self.assertEqual(parquet["on_ground"].tolist(), [False, True, False])
+
+    def test_upload_to_s3_uploads_nothing_if_a_payload_fails(self):
+        tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=None)
+        tracer.s3_client = mock.Mock()
+        with mock.patch("geopandas.GeoDataFrame.to_parquet", side_effect=ValueError("boom")):
+            with self.assertRaises(ValueError):
+                tracer.upload_to_s3(self._ground_frame(), "bucket", "a.csv", "a.geojson", parquet_object_name="a.parquet")
+        tracer.s3_client.upload_fileobj.assert_not_called()
+
+    @unittest.skipIf(core.zstd is None, "zstandard is not installed")
+    def test_upload_to_s3_compresses_text_payloads(self):
+        gdf = self._ground_frame()
+        tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=None)
+        tracer.s3_client = mock.Mock()
+        uploads = {}
+        tracer.s3_client.upload_fileobj.side_effect = (
+            lambda buffer, bucket, key, ExtraArgs, **kwargs: uploads.setdefault(key, (buffer.read(), ExtraArgs))
+        )
+        tracer.upload_to_s3(gdf, "bucket", "traces.csv", "traces.geojson", compress=True)
+
+        self.assertEqual(list(uploads), ["traces.csv.zst", "traces.geojson.zst"])
+        body, extra_args = uploads["traces.csv.zst"]
+        self.assertEqual(extra_args, {"ContentType": "text/csv", "ContentEncoding": "zstd"})
+        csv = core.zstd.ZstdDecompressor().decompressobj().decompress(body).decode()
+        self.assertEqual(csv, gdf.to_csv(index=False))
+
+    def test_upload_to_s3_names_the_compress_extra(self):
+        tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=None)
+        tracer.s3_client = mock.Mock()
+        with mock.patch.object(core, "zstd", None):
+            with self.assertRaisesRegex(ImportError, r"flight-tracer\[compress\]"):
+                tracer.upload_to_s3(self._ground_frame(), "bucket", "a.csv", "a.geojson", compress=True)
+        tracer.s3_client.upload_fileobj.assert_not_called()
+
+    def test_export_flight_data_keeps_ground_pings_distinguishable(self):
+        gdf = self._ground_frame()
+        tracer = FlightTracer(aircraft_ids=["abc123"], cache_dir=None)
+        with tempfile.TemporaryDirectory() as out_dir:
+            base_path = os.path.join(out_dir, "flights")
+            tracer.export_flight_data(gdf, base_path)
+            with open(f"{base_path}_points.geojson") as f:
+                properties = [feature["properties"] for feature in json.load(f)["features"]]
+
+        self.assertEqual([p["altitude"] for p in properties], [1000, None, 1200])
+        self.assertEqual([p["on_ground"] for p in properties], [False, True, False])
+
+    def _plot_frame(self):
+        raw_df = pd.DataFrame({
+            "time": [0.0, 60.0, 120.0, 9000.0, 9060.0],
+            "lat": [34.0, 34.1, 34.2, 35.0, 35.1],
+            "lon": [-118.0, -118.1, -118.2, -119.0, -119.1],
+            "altitude": [1000, 1100, 1200, 1300, 1400],
+            "ground_speed": [100.0] * 5,
+            "heading": [90.0] * 5,
+            "timestamp": [pd.Timestamp("2025-02-07")] * 5,
+            "icao": ["abc123"] * 5,
+        })
+        return FlightTracer.process_flight_data(None, raw_df)
+
+    def test_plot_flights_works_unbound(self):
+        # The CLI calls plot_flights on the class with self=None
+        gdf = self._plot_frame()
+        with mock.patch.object(core.ctx, "add_basemap") as add_basemap, \
+                mock.patch.object(core.ctx, "set_cache_dir") as set_cache_dir, \
+                mock.patch.object(core.plt, "show"):
+            FlightTracer.plot_flights(None, gdf, plot_engine="matplotlib")
+            FlightTracer.plot_flights(None, FlightTracer.create_linestrings(None, gdf), geometry_type="lines")
+        core.plt.close("all")
+        self.assertEqual(add_basemap.call_count, 2)
+        set_cache_dir.assert_called_with(os.path.join(FlightTracer.DEFAULT_CACHE_DIR, "tiles"))
+
+    @unittest.skipIf(core.ds is None, "datashader not installed")
+    def test_plot_flights_rasterizes_with_datashader(self):
+        gdf = self._plot_frame()
+        with mock.patch.object(core.ctx, "add_basemap"), mock.patch.object(core.ctx, "set_cache_dir"), \
+                mock.patch.object(core.plt, "show"), mock.patch.object(FlightTracer, "DATASHADER_MIN_POINTS", 1), \
+                mock.patch.object(core.plt.Axes, "imshow") as imshow:
+            FlightTracer.plot_flights(None, gdf, figsize=(2, 2))
+            FlightTracer.plot_flights(None, gdf, figsize=(2, 2), plot_engine="datashader")
+        core.plt.close("all")
+        self.assertEqual(imshow.call_count, 2)
+        pixels = np.asarray(imshow.call_args[0][0]).reshape(-1, 4)
+        # Only the two legs' colors (plus empty transparent pixels) appear in the raster
+        self.assertEqual(len(np.unique(pixels[pixels[:, 3] > 0], axis=0)), 2)
+
+    def test_leg_id_kernels_agree(self):
+        rng = np.random.default_rng(0)
+        group_keys = rng.integers(0, 5, size=2000)
+        times_ns = np.cumsum(rng.choice([10, 5000], size=2000, p=[0.95, 0.05])) * 1_000_000_000
+        threshold_ns = 3600 * 1_000_000_000
+
+        default = core._compute_leg_ids(group_keys, times_ns, threshold_ns)
+        with mock.patch.object(core, "njit", None):
+            numpy_only = core._compute_leg_ids(group_keys, times_ns, threshold_ns)
+        np.testing.assert_array_equal(default, numpy_only)
+        self.assertGreater(default.max(), 1)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file